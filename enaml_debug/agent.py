@@ -0,0 +1,620 @@
+""" In-process agent that streams layout snapshots of a running Enaml
+application to a debugger over a local socket.
+
+An application enables the agent on the Container whose layout it wants to
+inspect::
+
+    from enaml_debug.agent import DebugAgent
+
+    agent = DebugAgent()
+    agent.attach(window.central_widget)
+    agent.start()
+
+The Container must own its layout. The agent installs the DebugLayout hooks
+on it and listens on a localhost TCP port. While no debugger is connected,
+each layout_event costs a single attribute check. Once a debugger connects,
+it is sent the component tree and the constraint list, followed by only the
+variable values and constraint errors that changed on each layout_event.
+
+The Enaml tree and the solver are only ever read on the GUI thread. The
+background threads only accept connections and write out frames. Changes
+that pile up while the debugger is slow to read are merged, so the memory
+held for a debugger is bounded by the size of the layout.
+
+``enaml-debug --attach PORT`` shows the mirrored layout in the usual
+outline and table views.
+
+Wire format
+-----------
+Every message is a frame consisting of a header packed as ``!BI`` (the
+message type and the payload length in bytes) followed by the payload.
+Strings are UTF-8 encoded and prefixed with their length packed as ``!H``.
+
+MSG_TREE
+    ``!I`` count, then for each component: ``!i`` parent index (-1 for the
+    root), the type name and the hex id.
+MSG_CONSTRAINTS
+    ``!I`` variable count, then each variable name. ``!I`` constraint
+    count, then for each constraint: its text, its strength name, ``!d``
+    weight, ``!H`` term count and ``!I`` variable index per term.
+MSG_VALUES
+    ``!I`` count, then ``!Id`` pairs of variable index and value.
+MSG_ERRORS
+    ``!I`` count, then ``!Id`` pairs of constraint index and error.
+
+"""
+import socket
+import struct
+import threading
+
+from traits.api import (Any, Event, HasTraits, Instance, Int, List,
+    NO_COMPARE, Str, on_trait_change)
+
+from enaml.components.container import Container
+
+from .constraint_graph import split_var_name
+from .debug_layout import (DebugModel, component_hexid, install_debug_layout,
+    traverse_layout_parents)
+from .remote import RemoteComponent, RemoteConstraint, RemoteLayout, RemoteVariable
+
+
+# The default port the agent listens on.
+DEFAULT_PORT = 7319
+
+# Message types.
+MSG_TREE = 1
+MSG_CONSTRAINTS = 2
+MSG_VALUES = 3
+MSG_ERRORS = 4
+
+HEADER = struct.Struct('!BI')
+STRING_LEN = struct.Struct('!H')
+TERM_COUNT = struct.Struct('!H')
+COUNT = struct.Struct('!I')
+PARENT = struct.Struct('!i')
+WEIGHT = struct.Struct('!d')
+VALUE = struct.Struct('!Id')
+
+
+#### Encoding ##################################################################
+
+def pack_frame(msg_type, payload):
+    """ Wrap a payload in a frame header.
+
+    """
+    return HEADER.pack(msg_type, len(payload)) + payload
+
+def pack_string(text):
+    """ Pack a unicode string as length-prefixed UTF-8.
+
+    """
+    data = unicode(text).encode('utf-8')
+    return STRING_LEN.pack(len(data)) + data
+
+def pack_tree(pairs):
+    """ Pack the component tree, given as (component, parent) pairs in
+    traversal order.
+
+    """
+    indices = {}
+    parts = [COUNT.pack(len(pairs))]
+    for index, (component, parent) in enumerate(pairs):
+        indices[id(component)] = index
+        # Parents always come before their children in the traversal.
+        parts.append(PARENT.pack(indices[id(parent)] if parent is not None else -1))
+        parts.append(pack_string(type(component).__name__))
+        parts.append(pack_string(component_hexid(component)))
+    return pack_frame(MSG_TREE, ''.join(parts))
+
+def pack_constraints(constraints):
+    """ Pack the constraint list.
+
+    Returns
+    -------
+    frame : str
+        The packed MSG_CONSTRAINTS frame.
+    variables : list
+        The casuarius variables in index order.
+    """
+    var_indices = {}
+    variables = []
+    cn_parts = [COUNT.pack(len(constraints))]
+    for cn in constraints:
+        terms = cn.lhs.terms + cn.rhs.terms
+        cn_parts.append(pack_string(unicode(cn)))
+        cn_parts.append(pack_string(cn.strength.name))
+        cn_parts.append(WEIGHT.pack(cn.weight))
+        cn_parts.append(TERM_COUNT.pack(len(terms)))
+        for term in terms:
+            var = term.var
+            index = var_indices.get(var.name)
+            if index is None:
+                index = var_indices[var.name] = len(variables)
+                variables.append(var)
+            cn_parts.append(COUNT.pack(index))
+    var_parts = [COUNT.pack(len(variables))]
+    var_parts.extend(pack_string(var.name) for var in variables)
+    return pack_frame(MSG_CONSTRAINTS, ''.join(var_parts + cn_parts)), variables
+
+def pack_values(msg_type, pairs):
+    """ Pack a list of (index, value) pairs as a MSG_VALUES or MSG_ERRORS
+    frame.
+
+    """
+    parts = [COUNT.pack(len(pairs))]
+    parts.extend(VALUE.pack(index, value) for index, value in pairs)
+    return pack_frame(msg_type, ''.join(parts))
+
+
+#### Decoding ##################################################################
+
+class _Reader(object):
+    """ Sequentially unpack a payload.
+
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def string(self):
+        n, = self.unpack(STRING_LEN)
+        data = self.data[self.offset:self.offset+n]
+        self.offset += n
+        return data.decode('utf-8')
+
+
+def recv_exactly(sock, nbytes):
+    """ Read exactly nbytes from the socket.
+
+    Raises
+    ------
+    EOFError if the connection is closed first.
+    """
+    chunks = []
+    while nbytes > 0:
+        chunk = sock.recv(nbytes)
+        if not chunk:
+            raise EOFError('Connection closed')
+        chunks.append(chunk)
+        nbytes -= len(chunk)
+    return ''.join(chunks)
+
+def recv_frame(sock):
+    """ Read a single frame from the socket.
+
+    Returns
+    -------
+    msg_type : int
+    payload : str
+    """
+    msg_type, length = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return msg_type, recv_exactly(sock, length)
+
+
+#### Agent #####################################################################
+
+class _Connection(object):
+    """ The outgoing state for one connected debugger.
+
+    Frames describing the structure are sent in order. Value and error
+    changes are merged by index until the sender thread gets to them.
+
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.condition = threading.Condition()
+        self.frames = []
+        self.values = {}
+        self.errors = {}
+        self.closed = False
+
+        # Whether the snapshot has been posted. Only used on the GUI thread.
+        self.active = False
+
+    def post(self, frames=(), values=(), errors=(), reset=False):
+        """ Queue frames and merge value and error changes.
+
+        If reset is True, anything still pending is dropped first since
+        the frames replace it.
+
+        """
+        with self.condition:
+            if reset:
+                self.frames = []
+                self.values = {}
+                self.errors = {}
+            self.frames.extend(frames)
+            self.values.update(values)
+            self.errors.update(errors)
+            self.condition.notify()
+
+    def close(self):
+        """ Stop the sender thread and close the socket.
+
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        try:
+            # Unblock a sendall() stuck on a stalled debugger.
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def send_loop(self):
+        try:
+            while True:
+                with self.condition:
+                    while not (self.closed or self.frames or self.values or
+                        self.errors):
+                        self.condition.wait()
+                    if self.closed:
+                        break
+                    frames, self.frames = self.frames, []
+                    values, self.values = self.values, {}
+                    errors, self.errors = self.errors, {}
+                for frame in frames:
+                    self.sock.sendall(frame)
+                if values:
+                    self.sock.sendall(pack_values(MSG_VALUES,
+                        sorted(values.iteritems())))
+                if errors:
+                    self.sock.sendall(pack_values(MSG_ERRORS,
+                        sorted(errors.iteritems())))
+        except socket.error:
+            pass
+        finally:
+            self.sock.close()
+
+
+class DebugAgent(HasTraits):
+    """ Serve layout snapshots of a Container to a connected debugger.
+
+    Only one debugger is served at a time; a new connection replaces the
+    previous one.
+
+    """
+
+    # The Container being debugged.
+    root = Instance(Container)
+
+    # The interface and port to listen on.
+    host = Str('127.0.0.1')
+    port = Int(DEFAULT_PORT)
+
+    # The listening socket.
+    _server = Any()
+
+    # The connection to the debugger, or None when no debugger is
+    # connected. Only ever replaced as a whole so that the GUI thread can
+    # read it without locking.
+    _connection = Any()
+
+    # The toolkit's function to call something later on the GUI thread.
+    _invoke_later = Any()
+
+    # The casuarius variables and constraints in the order they were sent.
+    _variables = Any()
+    _constraints = Any()
+
+    # The last values and errors sent for each index.
+    _last_values = Any()
+    _last_errors = Any()
+
+    def attach(self, container):
+        """ Install the DebugLayout hooks on the given Container.
+
+        Raises
+        ------
+        ValueError if the Container has transferred the ownership of its
+        layout to an ancestor, since its layout manager never solves.
+        """
+        owner = container._layout_owner
+        if owner is not None:
+            msg = ('{0} does not own its layout; attach to the Container '
+                'owning it, {1}, instead'.format(container, owner))
+            raise ValueError(msg)
+        self.detach()
+        install_debug_layout(container)
+        self.root = container
+        self._invoke_later = container.toolkit.invoke_later
+        container.layout_manager.on_trait_change(self._on_layout,
+            'layout_event')
+        container.layout_manager.on_trait_change(self._on_constraints,
+            'current_constraints')
+
+    def detach(self):
+        """ Remove the hooks from the attached Container, if any.
+
+        The DebugLayout itself stays installed.
+
+        """
+        if self.root is not None:
+            self.root.layout_manager.on_trait_change(self._on_layout,
+                'layout_event', remove=True)
+            self.root.layout_manager.on_trait_change(self._on_constraints,
+                'current_constraints', remove=True)
+            self.root = None
+
+    def start(self):
+        """ Start listening for a debugger in a background thread.
+
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(1)
+        self._server = server
+        thread = threading.Thread(target=self._accept_loop, args=(server,),
+            name='enaml-debug-agent')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """ Stop listening, disconnect any debugger and remove the hooks.
+
+        """
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                # Closing alone does not wake up a blocked accept() on
+                # Linux.
+                server.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            server.close()
+        self._disconnect()
+        self.detach()
+
+    #### Private interface #####################################################
+
+    def _accept_loop(self, server):
+        while self._server is server:
+            try:
+                sock, addr = server.accept()
+            except socket.error:
+                break
+            if self._server is not server:
+                sock.close()
+                break
+            self._disconnect()
+            connection = _Connection(sock)
+            self._connection = connection
+            thread = threading.Thread(target=connection.send_loop,
+                name='enaml-debug-agent-sender')
+            thread.daemon = True
+            thread.start()
+            # The snapshot is built on the GUI thread, either here or on the
+            # next layout_event, whichever comes first.
+            self._invoke_later(self._activate, connection)
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            connection.close()
+
+    def _activate(self, connection):
+        """ Post the full snapshot to a new connection. Must be called on
+        the GUI thread.
+
+        """
+        if connection is not self._connection or connection.active:
+            return
+        self._post_snapshot(connection)
+        connection.active = True
+
+    def _post_snapshot(self, connection):
+        if self.root is None:
+            return
+        pairs = list(traverse_layout_parents(self.root))
+        constraints = list(self.root.layout_manager.current_constraints)
+        frame, variables = pack_constraints(constraints)
+        self._variables = variables
+        self._constraints = constraints
+        self._last_values = [var.value for var in variables]
+        self._last_errors = [cn.error for cn in constraints]
+        connection.post(
+            frames=[pack_tree(pairs), frame],
+            values=enumerate(self._last_values),
+            errors=enumerate(self._last_errors),
+            reset=True,
+        )
+
+    def _on_layout(self):
+        # Keep this cheap: the common case is that nobody is listening.
+        connection = self._connection
+        if connection is None:
+            return
+        if not connection.active:
+            self._activate(connection)
+            return
+        last_values = self._last_values
+        values = []
+        for index, var in enumerate(self._variables):
+            value = var.value
+            if value != last_values[index]:
+                last_values[index] = value
+                values.append((index, value))
+        last_errors = self._last_errors
+        errors = []
+        for index, cn in enumerate(self._constraints):
+            error = cn.error
+            if error != last_errors[index]:
+                last_errors[index] = error
+                errors.append((index, error))
+        if values or errors:
+            connection.post(values=values, errors=errors)
+
+    def _on_constraints(self):
+        connection = self._connection
+        if connection is not None and connection.active:
+            self._post_snapshot(connection)
+
+
+def enable_debug_agent(container, port=DEFAULT_PORT):
+    """ Attach a DebugAgent to the given Container and start listening.
+
+    Returns
+    -------
+    agent : DebugAgent
+    """
+    agent = DebugAgent(port=port)
+    agent.attach(container)
+    agent.start()
+    return agent
+
+
+#### Client ####################################################################
+
+class AgentClient(HasTraits):
+    """ Mirror the layout state streamed by a DebugAgent.
+
+    Frames are received on a background thread and applied on the GUI
+    thread.
+
+    """
+
+    # The mirrored components in traversal order.
+    components = List()
+
+    # The mirrored variables in index order.
+    variables = List()
+
+    # The mirrored constraints in index order.
+    constraints = List(comparison_mode=NO_COMPARE)
+
+    # Fired with the message type after each frame has been applied.
+    updated = Event()
+
+    # The connected socket.
+    _sock = Any()
+
+    def connect(self, host='127.0.0.1', port=DEFAULT_PORT):
+        """ Connect to a DebugAgent.
+
+        """
+        self._sock = socket.create_connection((host, port))
+
+    def close(self):
+        """ Close the connection.
+
+        """
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+
+    def start(self, invoke_later):
+        """ Receive frames in a background thread.
+
+        Parameters
+        ----------
+        invoke_later : callable
+            The toolkit's function to call something later on the GUI
+            thread. Each frame is applied through it.
+        """
+        thread = threading.Thread(target=self._receive_loop,
+            args=(invoke_later,), name='enaml-debug-client')
+        thread.daemon = True
+        thread.start()
+
+    def apply(self, msg_type, payload):
+        """ Apply a single frame.
+
+        """
+        reader = _Reader(payload)
+        if msg_type == MSG_TREE:
+            self._read_tree(reader)
+        elif msg_type == MSG_CONSTRAINTS:
+            self._read_constraints(reader)
+        elif msg_type == MSG_VALUES:
+            self._read_values(reader)
+        elif msg_type == MSG_ERRORS:
+            self._read_errors(reader)
+        self.updated = msg_type
+
+    def _receive_loop(self, invoke_later):
+        try:
+            while self._sock is not None:
+                msg_type, payload = recv_frame(self._sock)
+                invoke_later(self.apply, msg_type, payload)
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.close()
+
+    def _read_tree(self, reader):
+        components = []
+        count, = reader.unpack(COUNT)
+        for i in range(count):
+            parent, = reader.unpack(PARENT)
+            type_name = reader.string()
+            hexid = reader.string()
+            parent = components[parent] if parent >= 0 else None
+            components.append(RemoteComponent(type_name, hexid, parent))
+        self.components = components
+
+    def _read_constraints(self, reader):
+        by_hexid = dict((c.hexid, c) for c in self.components)
+        variables = []
+        count, = reader.unpack(COUNT)
+        for i in range(count):
+            var = RemoteVariable(reader.string())
+            variables.append(var)
+            # Give the owning component direct access to its variables.
+            class_name, hexid, attr = split_var_name(var.name)
+            component = by_hexid.get(hexid)
+            if component is not None:
+                setattr(component, attr, var)
+        constraints = []
+        count, = reader.unpack(COUNT)
+        for i in range(count):
+            text = reader.string()
+            strength = reader.string()
+            weight, = reader.unpack(WEIGHT)
+            nterms, = reader.unpack(TERM_COUNT)
+            terms = [variables[reader.unpack(COUNT)[0]] for j in range(nterms)]
+            constraints.append(RemoteConstraint(text, strength, weight, terms))
+        self.variables = variables
+        self.constraints = constraints
+
+    def _read_values(self, reader):
+        variables = self.variables
+        count, = reader.unpack(COUNT)
+        for i in range(count):
+            index, value = reader.unpack(VALUE)
+            variables[index].value = value
+
+    def _read_errors(self, reader):
+        constraints = self.constraints
+        count, = reader.unpack(COUNT)
+        for i in range(count):
+            index, error = reader.unpack(VALUE)
+            constraints[index].error = error
+
+
+class RemoteDebugModel(DebugModel):
+    """ DebugModel fed by an AgentClient rather than a local root.
+
+    """
+
+    client = Instance(AgentClient)
+
+    def _layout_manager_default(self):
+        return RemoteLayout()
+
+    @on_trait_change('client:updated')
+    def _client_updated(self, msg_type):
+        if msg_type == MSG_TREE:
+            self.components = self.client.components
+            self.hierarchy_changed()
+        elif msg_type == MSG_CONSTRAINTS:
+            self.layout_manager.current_constraints = self.client.constraints
+        elif msg_type in (MSG_VALUES, MSG_ERRORS):
+            self.layout_manager.layout_event()
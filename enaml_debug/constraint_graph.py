@@ -0,0 +1,128 @@
+from collections import deque
+
+from traits.api import Dict, HasTraits, Set
+
+
+def split_var_name(var_name):
+    """ Split a constraint variable name of the form
+    '<attr>_<class>_<hexid>' into its parts.
+
+    Returns
+    -------
+    class_name : str
+        The class name of the component owning the variable.
+    hexid : str
+        The hex id of the component.
+    attr : str
+        The attribute, e.g. 'width' or 'padding_left'.
+    """
+    attr, class_name, hexid = var_name.rsplit('_', 2)
+    return class_name, hexid, attr
+
+
+class ConstraintGraph(HasTraits):
+    """ Bipartite graph linking constraints to the variables they mention.
+
+    Constraints are keyed by identity since the same constraint object is
+    edited in place; variables are keyed by name.
+
+    """
+
+    # Map from id(constraint) to the constraint.
+    constraints = Dict()
+
+    # Map from id(constraint) to the set of variable names it mentions.
+    constraint_vars = Dict()
+
+    # Map from variable name to the set of id(constraint) mentioning it.
+    var_constraints = Dict()
+
+    # The hex ids of components whose variables searches report but do
+    # not expand, e.g. the root which every child is constrained against.
+    boundary_ids = Set()
+
+    def add_constraint(self, constraint):
+        """ Add a constraint to the graph.
+
+        """
+        key = id(constraint)
+        if key in self.constraints:
+            return
+        names = set(term.var.name
+            for term in constraint.lhs.terms + constraint.rhs.terms)
+        self.constraints[key] = constraint
+        self.constraint_vars[key] = names
+        for name in names:
+            self.var_constraints.setdefault(name, set()).add(key)
+
+    def remove_constraint(self, constraint):
+        """ Remove a constraint from the graph.
+
+        """
+        key = id(constraint)
+        if key not in self.constraints:
+            return
+        del self.constraints[key]
+        for name in self.constraint_vars.pop(key):
+            keys = self.var_constraints[name]
+            keys.discard(key)
+            if not keys:
+                del self.var_constraints[name]
+
+    def update(self, constraints):
+        """ Bring the graph in line with a new list of constraints, only
+        touching the constraints that were added or removed.
+
+        """
+        new = dict((id(cn), cn) for cn in constraints)
+        for key in set(self.constraints) - set(new):
+            self.remove_constraint(self.constraints[key])
+        for key in set(new) - set(self.constraints):
+            self.add_constraint(new[key])
+
+    def reachable(self, var_names=(), constraints=()):
+        """ Breadth-first search from the given variables and constraints.
+
+        Variables of boundary components are reached but not expanded,
+        unless they are among the seeds.
+
+        Returns
+        -------
+        var_names : set
+            The names of all variables connected to the seeds.
+        constraints : list
+            All constraints connected to the seeds.
+        """
+        boundary_ids = self.boundary_ids
+        seen_vars = set()
+        seen_cns = set()
+        queue = deque()
+        for name in var_names:
+            if name not in seen_vars:
+                seen_vars.add(name)
+                queue.append((True, name))
+        for cn in constraints:
+            key = id(cn)
+            if key in self.constraints and key not in seen_cns:
+                seen_cns.add(key)
+                queue.append((False, key))
+        while queue:
+            is_var, node = queue.popleft()
+            if is_var:
+                for key in self.var_constraints.get(node, ()):
+                    if key not in seen_cns:
+                        seen_cns.add(key)
+                        queue.append((False, key))
+            else:
+                for name in self.constraint_vars[node]:
+                    if name not in seen_vars:
+                        seen_vars.add(name)
+                        if split_var_name(name)[1] not in boundary_ids:
+                            queue.append((True, name))
+        return seen_vars, [self.constraints[key] for key in seen_cns]
+
+    def component_ids(self, var_names):
+        """ Get the hex ids of the components owning the given variables.
+
+        """
+        return set(split_var_name(name)[1] for name in var_names)
@@ -1,4 +1,6 @@
 from collections import defaultdict
+import hashlib
+import math
 import os
 import sys
 import types
@@ -7,8 +9,8 @@ from enable.api import (AbstractOverlay, ColorTrait,
     Component as EnableComponent, Container as EnableContainer, LineStyle,
     transparent_color)
 from kiva.constants import FILL, STROKE
-from traits.api import (Any, Bool, Float, HasTraits, Instance, List, Property,
-    NO_COMPARE, on_trait_change)
+from traits.api import (Any, Bool, Dict, Either, Float, HasTraits, Instance,
+    Int, List, Property, NO_COMPARE, on_trait_change)
 
 from casuarius import medium
 from enaml import imports
@@ -22,6 +24,9 @@ from enaml.item_models.abstract_item_model import (ALIGN_LEFT, ALIGN_RIGHT,
 from enaml.layout.constraints_layout import ConstraintsLayout
 from enaml.styling.font import Font
 
+from .constraint_graph import ConstraintGraph, split_var_name
+from .remote import RemoteComponent, RemoteLayout
+
 
 # Use a monospaced font for the tables.
 TABLE_FONT = Font('Courier New', point_size=10, family_hint='monospace')
@@ -35,6 +40,9 @@ class DebugLayout(HasTraits, ConstraintsLayout):
     current_constraints = List(comparison_mode=NO_COMPARE)
     layout_event = EnamlEvent()
 
+    # The (width, height) of the last layout.
+    last_size = Any()
+
     def initialize(self, constraints):
         self.current_constraints = constraints
         super(DebugLayout, self).initialize(constraints)
@@ -44,6 +52,7 @@ class DebugLayout(HasTraits, ConstraintsLayout):
             cb()
             self.layout_event()
 
+        self.last_size = (int(round(size[0])), int(round(size[1])))
         super(DebugLayout, self).layout(f, width, height, size, strength, weight)
 
 
@@ -67,11 +76,30 @@ class DebugModel(HasTraits):
     # The constraints that are selected.
     selected_constraints = List(comparison_mode=NO_COMPARE)
 
+    # The dependency graph between constraints and variables.
+    graph = Instance(ConstraintGraph, args=())
+
+    # The components found by the last impact query.
+    impact_components = List()
+
+    # The constraints found by the last impact query.
+    impact_constraints = List(comparison_mode=NO_COMPARE)
+
+    # Whether the results of an impact query are being shown. They may be
+    # empty.
+    impact_active = Bool(False)
+
     # Notify that the hierarchy has changed.
     hierarchy_changed = EnamlEvent()
 
-    # The layout manager for the root.
-    layout_manager = Instance(DebugLayout)
+    # The layout manager for the root. When debugging another process
+    # through a DebugAgent, this is a RemoteLayout.
+    layout_manager = Either(Instance(DebugLayout), Instance(RemoteLayout))
+
+    # The solutions persisted by a previous run for the current constraint
+    # set, as a map from the root (width, height) to a map from the keys of
+    # solution_variables() to values.
+    stored_solutions = Dict()
 
 
     @on_trait_change('root.children*')
@@ -94,6 +122,134 @@ class DebugModel(HasTraits):
         else:
             self.constraints = []
 
+    def _constraints_changed(self, new):
+        self.graph.update(new)
+        self.clear_impact()
+
+    @on_trait_change('components')
+    def _update_boundary(self):
+        # Every child is constrained against the root's geometry and
+        # padding, so impact queries must not spread through the root's
+        # variables to every other component.
+        if self.components:
+            self.graph.boundary_ids = set([component_hexid(self.components[0])])
+        else:
+            self.graph.boundary_ids = set()
+
+    def select_components(self, components):
+        """ Select components on behalf of the user, dropping the results
+        of any impact query if the selection actually changes.
+
+        """
+        if components != self.selected_components:
+            self.clear_impact()
+            self.selected_components = components
+
+    def moved_by_selected_constraints(self):
+        """ Find the components that can move if the selected constraints
+        change, along with the constraints connecting them.
+
+        """
+        var_names, constraints = self.graph.reachable(
+            constraints=self.selected_constraints)
+        self._set_impact(var_names, constraints)
+
+    def affecting_selected_components(self, attrs=('left', 'top', 'width',
+        'height')):
+        """ Find the constraints that transitively affect the given
+        attributes of the selected components.
+
+        """
+        var_names = []
+        for component in self.selected_components:
+            for attr in attrs:
+                var = getattr(component, attr, None)
+                if var is not None:
+                    var_names.append(var.name)
+        var_names, constraints = self.graph.reachable(var_names=var_names)
+        self._set_impact(var_names, constraints)
+
+    def clear_impact(self):
+        """ Clear the results of the last impact query.
+
+        """
+        # Listeners rely on impact_constraints being assigned last.
+        self.impact_active = False
+        self.impact_components = []
+        self.impact_constraints = []
+
+    def solution_variables(self):
+        """ Get the variables of the layout keyed by a name that is stable
+        across runs.
+
+        Variable names embed the id() of their component, so the key
+        replaces it with the component's position in the traversal.
+
+        Returns
+        -------
+        variables : dict
+            Map from '<index>:<attr>' keys to variables.
+        """
+        indices = dict((component_hexid(c), i)
+            for i, c in enumerate(self.components))
+        variables = {}
+        for cn in self.constraints:
+            for term in cn.lhs.terms + cn.rhs.terms:
+                var = term.var
+                class_name, hexid, attr = split_var_name(var.name)
+                index = indices.get(hexid)
+                if index is not None:
+                    variables['{0}:{1}'.format(index, attr)] = var
+        return variables
+
+    def solution_signature(self):
+        """ Get a hash of the constraint set which is stable across runs.
+
+        """
+        keys = dict((var.name, key)
+            for key, var in self.solution_variables().iteritems())
+        sha = hashlib.sha1()
+        for cn in self.constraints:
+            text = unicode(cn)
+            # Replace the longest names first so that no name is clobbered
+            # by another one that happens to be its prefix.
+            names = set(term.var.name for term in cn.lhs.terms + cn.rhs.terms)
+            for name in sorted(names, key=len, reverse=True):
+                text = text.replace(name, keys.get(name, name))
+            sha.update(text.encode('utf-8'))
+            sha.update(cn.strength.name.encode('utf-8'))
+            sha.update(repr(cn.weight))
+        return sha.hexdigest()
+
+    def load_solutions(self, store):
+        """ Load the solutions persisted in a PersistSolutions store.
+
+        The store is cleared if they were solved for other constraints.
+
+        """
+        self.stored_solutions = store.load(self.solution_signature())
+
+    def save_solution(self, store):
+        """ Persist the current solution to a PersistSolutions store.
+
+        """
+        if self.layout_manager is None or self.layout_manager.last_size is None:
+            return
+        values = dict((key, var.value)
+            for key, var in self.solution_variables().iteritems())
+        store.save(self.solution_signature(), self.layout_manager.last_size,
+            values)
+
+    def _set_impact(self, var_names, constraints):
+        ids = self.graph.component_ids(var_names)
+        keys = set(id(cn) for cn in constraints)
+        impact_constraints = [cn for cn in self.constraints if id(cn) in keys]
+        # Listeners rely on impact_constraints being assigned last.
+        self.impact_active = True
+        self.impact_components = [c for c in self.components
+            if component_hexid(c) in ids]
+        self.impact_constraints = impact_constraints
+
 
 class Coords(HasTraits):
     """ Simple holder of box-related data.
@@ -131,16 +287,22 @@ class Box(EnableComponent):
 
     """
 
-    enaml = Instance(ConstraintsWidget)
+    enaml = Either(Instance(ConstraintsWidget), Instance(RemoteComponent))
     highlighted = Bool(False)
 
+    # Whether the component was found by an impact query.
+    impacted = Bool(False)
+
     normal_fill_color = ColorTrait('transparent')
     highlight_fill_color = ColorTrait('red')
-    fill_color = Property(depends_on=['highlighted', 'normal_fill_color',
-        'highlight_border_color'])
+    impact_fill_color = ColorTrait((1.0, 0.65, 0.0, 0.3))
+    fill_color = Property(depends_on=['highlighted', 'impacted',
+        'normal_fill_color', 'highlight_border_color', 'impact_fill_color'])
     def _get_fill_color(self):
         if self.highlighted:
             return self.highlight_fill_color_
+        elif self.impacted:
+            return self.impact_fill_color_
         else:
             return self.normal_fill_color_
 
@@ -160,7 +322,7 @@ class Box(EnableComponent):
         """ Update the geometry from the Enaml component.
 
         """
-        if self.enaml.abstract_obj is not None and self.enaml.abstract_obj.widget is not None:
+        if is_realized(self.enaml):
             coords = self.coords
             coords.left = self.enaml.left.value
             coords.top = self.enaml.top.value
@@ -223,6 +385,106 @@ class Box(EnableComponent):
                         dy-coords.padding_top-coords.padding_bottom), STROKE)
 
 
+class BoxIndex(HasTraits):
+    """ Multi-level grid spatial index over Box geometries for fast picking.
+
+    Each level is a uniform grid in the Enaml coordinate system (origin at
+    the top-left) with cells twice as large as the level below. A box is
+    bucketed at the finest level whose cells are at least half as large as
+    the box, so it lands in at most nine cells no matter how large it is.
+    A point query looks at the one cell containing the point on each
+    level.
+
+    """
+
+    # The side length of the cells on the finest level.
+    cell_size = Float(1.0)
+
+    # The number of levels.
+    levels = Int(1)
+
+    # Map from (level, column, row) cell keys to lists of (rank, box)
+    # pairs.
+    cells = Dict()
+
+    # The maximum number of cells on each side of the finest level.
+    max_cells_per_axis = 64
+
+    def rebuild(self, boxes):
+        """ Rebuild the index from scratch for the given Boxes.
+
+        The boxes should be given in traversal order so that the rank of
+        a box reflects its depth in the hierarchy.
+
+        """
+        cells = defaultdict(list)
+        rects = []
+        right = bottom = 0.0
+        for rank, box in enumerate(boxes):
+            coords = box.coords
+            if coords.width <= 0 or coords.height <= 0:
+                continue
+            rects.append((rank, box, coords.left, coords.top,
+                coords.left + coords.width, coords.top + coords.height))
+            right = max(right, coords.left + coords.width)
+            bottom = max(bottom, coords.top + coords.height)
+        if not rects:
+            self.cells = {}
+            return
+
+        # Aim for roughly one box per cell on the finest level, capped at
+        # max_cells_per_axis cells on each side. The coarsest level has a
+        # single cell covering everything.
+        extent = max(right, bottom, 1.0)
+        ncells = min(max(int(math.sqrt(len(rects))), 1), self.max_cells_per_axis)
+        cell_size = extent / ncells
+        levels = int(math.ceil(math.log(ncells, 2))) + 1
+        self.cell_size = cell_size
+        self.levels = levels
+
+        for rank, box, x0, y0, x1, y1 in rects:
+            level = 0
+            size = cell_size
+            largest = max(x1 - x0, y1 - y0)
+            while 2 * size < largest and level < levels - 1:
+                level += 1
+                size *= 2
+            for i in range(int(x0 // size), int(x1 // size) + 1):
+                for j in range(int(y0 // size), int(y1 // size) + 1):
+                    cells[level, i, j].append((rank, box))
+        self.cells = dict(cells)
+
+    def pick(self, x, y):
+        """ Find the innermost Box containing the point (x, y) given in
+        Enaml coordinates.
+
+        The innermost box is the one with the smallest area. Ties are
+        broken in favor of the box that comes latest in traversal order,
+        i.e. the deepest one.
+
+        Returns
+        -------
+        box : Box or None
+        """
+        cells = self.cells
+        candidates = []
+        size = self.cell_size
+        for level in range(self.levels):
+            candidates.extend(cells.get((level, int(x // size), int(y // size)), ()))
+            size *= 2
+        best = None
+        best_key = None
+        for rank, box in candidates:
+            coords = box.coords
+            if (coords.left <= x <= coords.left + coords.width and
+                coords.top <= y <= coords.top + coords.height):
+                box_key = (coords.width * coords.height, -rank)
+                if best_key is None or box_key < best_key:
+                    best = box
+                    best_key = box_key
+        return best
+
+
 class ViewOutlines(EnableContainer):
     """ Enable component that shows Boxes for Enaml components.
 
@@ -230,6 +492,18 @@ class ViewOutlines(EnableContainer):
 
     model = Instance(DebugModel)
 
+    # The spatial index used to pick Boxes under the mouse.
+    index = Instance(BoxIndex, args=())
+
+    # Whether the Boxes moved since the index was last built. The index is
+    # only rebuilt on the next pick so that interactive resizes, which
+    # fire many layout events, do not pay for it.
+    index_dirty = Bool(True)
+
+    # Whether to select the component under the mouse when hovering rather
+    # than only when clicking.
+    pick_on_hover = Bool(False)
+
     # No padding.
     padding_left = 0
     padding_right = 0
@@ -243,6 +517,7 @@ class ViewOutlines(EnableContainer):
             for component in self.model.components:
                 box = Box(enaml=component)
                 self.add(box)
+        self.index_dirty = True
 
     @on_trait_change('model:layout_manager:layout_event')
     def update_from_enaml(self):
@@ -251,8 +526,54 @@ class ViewOutlines(EnableContainer):
         """
         for box in self.components:
             box.update_from_enaml()
+        self.index_dirty = True
         self.request_redraw()
 
+    def pick(self, x, y):
+        """ Find the innermost Enaml component under the given point in
+        Enable coordinates.
+
+        Returns
+        -------
+        component : ConstraintsWidget or None
+        """
+        if self.index_dirty:
+            self.index.rebuild(self.components)
+            self.index_dirty = False
+        box = self.index.pick(x, self.height - y)
+        if box is None:
+            return None
+        return box.enaml
+
+    def select_at(self, x, y, explicit=False):
+        """ Select the innermost Enaml component under the given point in
+        Enable coordinates.
+
+        An explicit selection, e.g. by clicking, clears the results of any
+        impact query.
+
+        """
+        if self.model is None:
+            return
+        component = self.pick(x, y)
+        if component is None:
+            selected = []
+        else:
+            selected = [component]
+        if explicit:
+            self.model.select_components(selected)
+        elif selected != self.model.selected_components:
+            self.model.selected_components = selected
+
+    def normal_left_down(self, event):
+        self.select_at(event.x, event.y, explicit=True)
+        event.handled = True
+
+    def normal_mouse_move(self, event):
+        # Hovering leaves the results of impact queries alone.
+        if self.pick_on_hover:
+            self.select_at(event.x, event.y)
+
     @on_trait_change('model:selected_components')
     def highlight(self):
         """ Highlight the selected Enaml components.
@@ -262,6 +583,15 @@ class ViewOutlines(EnableContainer):
             box.highlighted = (box.enaml in self.model.selected_components)
         self.request_redraw()
 
+    @on_trait_change('model:impact_components')
+    def highlight_impact(self):
+        """ Highlight the Enaml components found by an impact query.
+
+        """
+        for box in self.components:
+            box.impacted = (box.enaml in self.model.impact_components)
+        self.request_redraw()
+
 
 class ConstraintsOverlay(AbstractOverlay):
     """ Highlight the selected constraints on the outline view.
@@ -270,7 +600,7 @@ class ConstraintsOverlay(AbstractOverlay):
 
     model = Instance(DebugModel)
 
-    # Map from box name to Coords.
+    # Map from component hex id to Coords.
     boxes = Any()
 
     # Style options for the lines.
@@ -288,19 +618,14 @@ class ConstraintsOverlay(AbstractOverlay):
             for constraint in layout_mgr.current_constraints:
                 for expr in (constraint.lhs, constraint.rhs):
                     for term in expr.terms:
-                        name, attr = self.split_var_name(term.var.name)
-                        setattr(self.boxes[name], attr, term.var.value)
+                        class_name, hexid, attr = split_var_name(term.var.name)
+                        setattr(self.boxes[hexid], attr, term.var.value)
         self.request_redraw()
 
     @on_trait_change('model.selected_constraints')
     def _selected_constraints_changed(self):
         self.request_redraw()
 
-    def split_var_name(self, var_name):
-        attr, class_name, hexid = var_name.rsplit('_', 2)
-        name = '{}_{}'.format(class_name, hexid)
-        return name, attr
-
     def overlay(self, other_component, gc, view_bounds=None, mode="normal"):
         """ Draws this component overlaid on another component.
 
@@ -317,9 +642,10 @@ class ConstraintsOverlay(AbstractOverlay):
             for constraint in self.model.selected_constraints:
                 for expr in (constraint.lhs, constraint.rhs):
                     for term in expr.terms:
-                        term_attrs.add(self.split_var_name(term.var.name))
-            for name, attr in sorted(term_attrs):
-                box = self.boxes[name]
+                        class_name, hexid, attr = split_var_name(term.var.name)
+                        term_attrs.add((hexid, attr))
+            for hexid, attr in sorted(term_attrs):
+                box = self.boxes[hexid]
                 if attr == 'top':
                     self.hline(gc, box.left, box.top, box.width)
                 elif attr == 'left':
@@ -427,10 +753,10 @@ class ComponentModel(AbstractTableModel):
             nancestors = 0
         else:
             nancestors = len(list(component.traverse_ancestors(self.debug_model.components[0])))+1
-        return u'{0}{1}'.format(u'\u2003'*nancestors, type(component).__name__)
+        return u'{0}{1}'.format(u'\u2003'*nancestors, component_type_name(component))
 
     def _get_id(self, component):
-        return u'{0:x}'.format(id(component))
+        return unicode(component_hexid(component))
 
     def _get_top(self, component):
         return unicode(int(round(component.top.value)))
@@ -455,6 +781,9 @@ class ConstraintsModel(AbstractTableModel):
         self.debug_model.on_trait_change(self.update, 'constraints')
         self.debug_model.on_trait_change(self.update, 'layout_manager:layout_event')
         self.debug_model.on_trait_change(self.filter, 'selected_components')
+        # impact_constraints is always assigned last, so one update covers
+        # a whole impact query or clear.
+        self.debug_model.on_trait_change(self.update, 'impact_constraints')
 
         self._data = []
         self._filter_ids = ()
@@ -494,7 +823,11 @@ class ConstraintsModel(AbstractTableModel):
 
         """
         self.begin_reset_model()
-        if self._filter_ids:
+        # The results of an impact query take precedence over the filter on
+        # the selected components.
+        if self.debug_model.impact_active:
+            self.filtered_constraints = self.debug_model.impact_constraints
+        elif self._filter_ids:
             self.filtered_constraints = []
             for cn in self.debug_model.constraints:
                 for term in cn.lhs.terms + cn.rhs.terms:
@@ -518,7 +851,7 @@ class ConstraintsModel(AbstractTableModel):
         belonging to the given components.
 
         """
-        self._filter_ids = tuple('_{0:x}'.format(id(c))
+        self._filter_ids = tuple('_' + component_hexid(c)
             for c in self.debug_model.selected_components)
         self.update()
 
@@ -540,22 +873,75 @@ def debugize_container(container):
     assert type(container) is Container
     container.__class__ = DebugContainer
     container._layout_owner = None
-    container.add_trait('layout_manager', Instance(DebugLayout, args=()))
     container.hug = ('weak', 'weak')
+    install_debug_layout(container)
+
+
+def install_debug_layout(container):
+    """ Replace the layout manager of a Container with a DebugLayout,
+    leaving the rest of the Container alone.
+
+    The Container should own its layout, e.g. the central widget of a
+    window, or the DebugLayout will never be asked to solve.
+
+    """
+    container.add_trait('layout_manager', Instance(DebugLayout, args=()))
     container.initialize_layout()
 
 
+def component_hexid(component):
+    """ Get the hex id which ends the names of a component's variables.
+
+    """
+    if isinstance(component, RemoteComponent):
+        return component.hexid
+    return '{0:x}'.format(id(component))
+
+
+def component_type_name(component):
+    """ Get the class name of a component.
+
+    """
+    if isinstance(component, RemoteComponent):
+        return component.type_name
+    return type(component).__name__
+
+
+def is_realized(component):
+    """ Whether a component has a toolkit widget, and hence geometry.
+
+    Components mirrored from another process always do.
+
+    """
+    if isinstance(component, RemoteComponent):
+        return True
+    abstract_obj = component.abstract_obj
+    return abstract_obj is not None and abstract_obj.widget is not None
+
+
 def traverse_layout(root):
     """ Traverse the laid out components starting with the root container.
 
     """
-    yield root
+    for component, parent in traverse_layout_parents(root):
+        yield component
+
+
+def traverse_layout_parents(root, parent=None):
+    """ Traverse the laid out components starting with the root container,
+    yielding (component, parent) pairs.
+
+    The parent is the laid out Container holding the component in its
+    constraints_children, or the given parent for the root itself.
+
+    """
+    yield root, parent
     for child in root.constraints_children:
         if isinstance(child, Container) and child.transfer_layout_ownership(root):
-            for c in traverse_layout(child):
-                yield c
+            for pair in traverse_layout_parents(child, root):
+                yield pair
         elif isinstance(child, ConstraintsWidget):
-            yield child
+            yield child, root
 
 
 def read_component(enaml_file, requested='Main'):
@@ -13,8 +13,9 @@ import sys
 from traits.etsconfig.api import ETSConfig
 from enaml import imports, default_toolkit, wx_toolkit, qt_toolkit
 
+from .agent import AgentClient, RemoteDebugModel
 from .debug_layout import read_component
-from .persist_geometry import PersistGeometry
+from .persist_geometry import PersistGeometry, PersistSolutions
 
 
 toolkits = {
@@ -23,6 +24,25 @@ toolkits = {
 
 ETSConfig._get_application_dirname = lambda: 'enaml_debug'
 
+def attach(port, toolkit):
+    """ Show the layout of a running application through its DebugAgent.
+
+    """
+    client = AgentClient()
+    try:
+        client.connect(port=port)
+    except Exception, e:
+        raise SystemExit('Error: ' + str(e))
+
+    with toolkits[toolkit]():
+        with imports():
+            from enaml_debug.debug_ui import RemoteDebugUI
+
+        window = RemoteDebugUI(model=RemoteDebugModel(client=client))
+        client.start(window.toolkit.invoke_later)
+        window.show()
+    client.close()
+
 def main():
     usage = 'usage: %prog [options] enaml_file'
     parser = optparse.OptionParser(usage=usage, description=__doc__)
@@ -31,9 +51,16 @@ def main():
     parser.add_option('-t', '--toolkit', default='default',
                       choices=['default', 'wx', 'qt'],
                       help='The toolkit backend to use')
+    parser.add_option('-a', '--attach', type='int', metavar='PORT',
+                      help='Attach to the debug agent of a running '
+                           'application on the given port')
     
     options, args = parser.parse_args()
 
+    if options.attach is not None:
+        attach(options.attach, options.toolkit)
+        return
+
     if len(args) == 0:
         print 'No .enaml file specified'
         sys.exit()
@@ -43,7 +70,10 @@ def main():
     else:
         enaml_file = args[0]
 
-    pg = PersistGeometry(datadir=ETSConfig.get_application_home(create=True))
+    datadir = ETSConfig.get_application_home(create=True)
+    pg = PersistGeometry(datadir=datadir)
+    ps = PersistSolutions(datadir=datadir, enaml_file=enaml_file,
+                          component=options.component)
     with toolkits[options.toolkit]():
         try:
             factory, module = read_component(enaml_file, requested=options.component)
@@ -53,9 +83,11 @@ def main():
         with imports():
             from enaml_debug.debug_ui import DebugLayoutUI, get_geometry
 
-        window = DebugLayoutUI(root=factory().central_widget, persist_geometry=pg)
+        window = DebugLayoutUI(root=factory().central_widget,
+                               persist_geometry=pg, persist_solutions=ps)
         window.show()
         pg.save(get_geometry(window))
+        window.model.save_solution(ps)
 
 if __name__ == '__main__':
     main()
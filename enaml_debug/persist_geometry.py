@@ -1,7 +1,9 @@
+from array import array
 import cPickle
+import hashlib
 import os
 
-from traits.api import HasTraits, Property, Str
+from traits.api import HasTraits, Int, Property, Str
 
 
 class PersistGeometry(HasTraits):
@@ -39,3 +41,123 @@ class PersistGeometry(HasTraits):
             os.makedirs(self.datadir)
         with open(self.filename, 'wb') as f:
             cPickle.dump(geometry, f, cPickle.HIGHEST_PROTOCOL)
+
+
+class PersistSolutions(HasTraits):
+    """ Handle the persistence of solved layout variable values for one
+    component of one .enaml file.
+
+    The values are stored per root size. They are thrown away when the
+    .enaml file's contents or the signature of the constraint set change.
+
+    """
+
+    # The application data directory.
+    datadir = Str()
+
+    # The .enaml file holding the component.
+    enaml_file = Str()
+
+    # The name of the component.
+    component = Str('Main')
+
+    # The maximum number of root sizes to keep solutions for.
+    max_sizes = Int(8)
+
+    # The solutions pickle filename.
+    filename = Property(Str, depends_on=['datadir', 'enaml_file', 'component'])
+    def _get_filename(self):
+        key = u'{0}\0{1}'.format(os.path.abspath(self.enaml_file),
+            self.component).encode('utf-8')
+        return os.path.join(self.datadir, 'solutions',
+            hashlib.sha1(key).hexdigest() + '.pkl')
+
+    # The hash of the .enaml file's contents.
+    content_hash = Property(Str, depends_on=['enaml_file'])
+    def _get_content_hash(self):
+        try:
+            with open(self.enaml_file, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except IOError:
+            return ''
+
+    def load(self, signature):
+        """ Load the persisted solutions, if any.
+
+        Parameters
+        ----------
+        signature : str
+            The signature of the current constraint set. If it does not
+            match the persisted one, the store is cleared.
+
+        Returns
+        -------
+        solutions : dict
+            Map from (width, height) to a dict mapping variable keys to
+            values.
+        """
+        data = self._read()
+        if data is None:
+            return {}
+        if (data.get('content_hash') != self.content_hash or
+            data.get('signature') != signature):
+            self.clear()
+            return {}
+        keys = data['keys']
+        solutions = {}
+        for size, values in data['solutions']:
+            solutions[size] = dict(zip(keys, values))
+        return solutions
+
+    def save(self, signature, size, values):
+        """ Save the solution for the given root size.
+
+        Parameters
+        ----------
+        signature : str
+            The signature of the current constraint set.
+        size : tuple of int
+            The (width, height) of the root.
+        values : dict
+            Map from variable keys to values.
+        """
+        keys = sorted(values)
+        data = self._read()
+        if (data is None or data.get('content_hash') != self.content_hash or
+            data.get('signature') != signature or data.get('keys') != keys):
+            solutions = []
+        else:
+            solutions = [(s, v) for s, v in data['solutions'] if s != size]
+        # Most recently saved first.
+        solutions.insert(0, (size, array('d', [values[k] for k in keys])))
+        data = dict(
+            content_hash=self.content_hash,
+            signature=signature,
+            keys=keys,
+            solutions=solutions[:self.max_sizes],
+        )
+        dirname = os.path.dirname(self.filename)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(self.filename, 'wb') as f:
+            cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+
+    def clear(self):
+        """ Remove the persisted solutions.
+
+        """
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def _read(self):
+        data = None
+        filename = self.filename
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as f:
+                    data = cPickle.load(f)
+            except Exception:
+                pass
+        return data
@@ -0,0 +1,130 @@
+""" Stand-ins for the Enaml components, casuarius constraints and layout
+manager of an application observed through a DebugAgent.
+
+They provide just enough of the interface used by the debugger's views
+to display the mirrored state.
+
+"""
+from traits.api import HasTraits, List, NO_COMPARE
+
+from enaml.core.trait_types import EnamlEvent
+
+
+class RemoteVariable(object):
+    """ A mirrored casuarius variable.
+
+    """
+
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name, value=0.0):
+        self.name = name
+        self.value = value
+
+
+class RemoteTerm(object):
+    """ A mirrored term of a constraint's expression.
+
+    """
+
+    __slots__ = ('var',)
+
+    def __init__(self, var):
+        self.var = var
+
+
+class RemoteExpression(object):
+    """ A mirrored side of a constraint.
+
+    """
+
+    __slots__ = ('terms',)
+
+    def __init__(self, terms=()):
+        self.terms = tuple(terms)
+
+
+class RemoteStrength(object):
+    """ A mirrored constraint strength.
+
+    """
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class RemoteConstraint(object):
+    """ A mirrored constraint.
+
+    The agent does not send the two sides of a constraint separately, so
+    all of its terms are on the left-hand side.
+
+    """
+
+    def __init__(self, text, strength, weight, variables):
+        self.text = text
+        self.strength = RemoteStrength(strength)
+        self.weight = weight
+        self.error = 0.0
+        self.lhs = RemoteExpression(RemoteTerm(var) for var in variables)
+        self.rhs = RemoteExpression()
+
+    def __unicode__(self):
+        return self.text
+
+
+class _DerivedValue(object):
+    """ A read-only value computed from other variables.
+
+    """
+
+    def __init__(self, getter):
+        self._getter = getter
+
+    @property
+    def value(self):
+        return self._getter()
+
+
+class RemoteComponent(object):
+    """ A mirrored Enaml component.
+
+    The component's variables are set as attributes named after their
+    attribute, e.g. ``width`` or ``padding_left``, so that optional ones
+    can be tested for with hasattr() as for real components.
+
+    """
+
+    def __init__(self, type_name, hexid, parent=None):
+        self.type_name = type_name
+        self.hexid = hexid
+        self.parent = parent
+        # Placeholders until the constraints mentioning them arrive.
+        for attr in ('left', 'top', 'width', 'height'):
+            name = '{0}_{1}_{2}'.format(attr, type_name, hexid)
+            setattr(self, attr, RemoteVariable(name))
+        self.v_center = _DerivedValue(
+            lambda: self.top.value + 0.5 * self.height.value)
+        self.h_center = _DerivedValue(
+            lambda: self.left.value + 0.5 * self.width.value)
+
+    def traverse_ancestors(self, root=None):
+        """ Yield the ancestors of this component up to, but excluding,
+        the given root.
+
+        """
+        parent = self.parent
+        while parent is not None and parent is not root:
+            yield parent
+            parent = parent.parent
+
+
+class RemoteLayout(HasTraits):
+    """ Stand-in for the DebugLayout of the observed Container.
+
+    """
+
+    current_constraints = List(comparison_mode=NO_COMPARE)
+    layout_event = EnamlEvent()